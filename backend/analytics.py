@@ -0,0 +1,191 @@
+"""Batched analytics event ingestion.
+
+Request handlers hand events to EventIngestor.offer(), which never waits on
+Mongo. A background task drains the bounded queue and writes whole batches:
+raw events go to one collection via insert_many, and per-key counts for each
+time bucket are upserted into another with a single bulk_write.
+"""
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+
+def bucket_start(ts: datetime, bucket_seconds: int) -> str:
+    epoch = int(ts.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % bucket_seconds, timezone.utc).isoformat()
+
+
+class EventIngestor:
+    def __init__(self, events, counts, max_queue: int = 10000, batch_size: int = 500,
+                 flush_interval: float = 1.0, bucket_seconds: int = 3600,
+                 events_ttl_seconds: Optional[int] = None):
+        self.events = events
+        self.counts = counts
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.bucket_seconds = bucket_seconds
+        self.events_ttl_seconds = events_ttl_seconds
+        # flushed/failed count raw events; counts_failed counts events whose aggregate counts were lost
+        self.stats = {"accepted": 0, "dropped": 0, "flushed": 0, "failed": 0, "counts_failed": 0, "batches": 0}
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._stopping = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def _make_event(self, event_type: str, product_id: Optional[str], term: Optional[str]) -> dict:
+        return {
+            "type": event_type,
+            "product_id": product_id,
+            "term": term.strip().lower() if term else None,
+            "ts": datetime.now(timezone.utc)
+        }
+
+    def offer(self, event_type: str, product_id: Optional[str] = None, term: Optional[str] = None) -> bool:
+        # Non-blocking: when the queue is full the event is dropped and counted
+        try:
+            self._queue.put_nowait(self._make_event(event_type, product_id, term))
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            return False
+        self.stats["accepted"] += 1
+        return True
+
+    def offer_many(self, events: list) -> bool:
+        # Accept every (type, product_id, term) tuple or none of them; nothing awaits in between
+        free = self._queue.maxsize - self._queue.qsize() if self._queue.maxsize > 0 else len(events)
+        if len(events) > free:
+            self.stats["dropped"] += len(events)
+            return False
+        for event in events:
+            self._queue.put_nowait(self._make_event(*event))
+        self.stats["accepted"] += len(events)
+        return True
+
+    async def ensure_indexes(self):
+        # Upserts look buckets up by (type, key, bucket); unique also stops duplicates across workers
+        await self.counts.create_index([("type", 1), ("key", 1), ("bucket", 1)], unique=True)
+
+        # The plain and TTL ts indexes share a name, so reconcile an existing one instead of conflicting
+        current = (await self.events.index_information()).get("ts_1")
+        if current is not None and current.get("expireAfterSeconds") != self.events_ttl_seconds:
+            if self.events_ttl_seconds is not None and "expireAfterSeconds" in current:
+                await self.events.database.command({
+                    "collMod": self.events.name,
+                    "index": {"keyPattern": {"ts": 1}, "expireAfterSeconds": self.events_ttl_seconds}
+                })
+                return
+            await self.events.drop_index("ts_1")
+
+        if self.events_ttl_seconds is not None:
+            await self.events.create_index("ts", expireAfterSeconds=self.events_ttl_seconds)
+        else:
+            await self.events.create_index("ts")
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "queued": self._queue.qsize(), "capacity": self._queue.maxsize}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Wake the flush loop so it drains the queue without waiting, then wait for it to exit
+        if self._task is None:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+
+    async def _next_event(self, timeout: float) -> Optional[dict]:
+        # Wait for an event, but wake up early when stop() is called
+        get = asyncio.ensure_future(self._queue.get())
+        stopping = asyncio.ensure_future(self._stopping.wait())
+        await asyncio.wait({get, stopping}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        stopping.cancel()
+        if get.done():
+            return get.result()
+        get.cancel()
+        return None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = []
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                timeout = deadline - loop.time()
+                if self._stopping.is_set() or timeout <= 0:
+                    break
+                event = await self._next_event(timeout)
+                if event is None:
+                    break
+                batch.append(event)
+            if batch:
+                await self._flush(batch)
+
+    def _aggregate(self, batch: list) -> Counter:
+        counts = Counter()
+        for event in batch:
+            key = event["product_id"] if event["type"] != "search" else event["term"]
+            if key:
+                counts[(event["type"], key, bucket_start(event["ts"], self.bucket_seconds))] += 1
+        return counts
+
+    async def _insert_events(self, batch: list) -> list:
+        # Returns the events that were actually written; with ordered=False some may fail on their own
+        try:
+            await self.events.insert_many(batch, ordered=False)
+            inserted = batch
+        except BulkWriteError as e:
+            failed = {error["index"] for error in e.details.get("writeErrors", [])}
+            inserted = [event for i, event in enumerate(batch) if i not in failed]
+            logger.warning("Failed to insert %d of %d analytics events", len(failed), len(batch))
+        except Exception:
+            inserted = []
+            logger.exception("Failed to insert %d analytics events", len(batch))
+        self.stats["flushed"] += len(inserted)
+        self.stats["failed"] += len(batch) - len(inserted)
+        return inserted
+
+    async def _write_counts(self, events: list):
+        counts = self._aggregate(events)
+        if not counts:
+            return
+        keys = list(counts)
+        ops = [
+            UpdateOne(
+                {"type": event_type, "key": key, "bucket": bucket},
+                {"$inc": {"count": counts[(event_type, key, bucket)]}},
+                upsert=True
+            )
+            for event_type, key, bucket in keys
+        ]
+        try:
+            await self.counts.bulk_write(ops, ordered=False)
+            return
+        except BulkWriteError as e:
+            lost = sum(counts[keys[error["index"]]] for error in e.details.get("writeErrors", []))
+            logger.warning("Failed to update %d analytics counts", len(e.details.get("writeErrors", [])))
+        except Exception:
+            lost = sum(counts.values())
+            logger.exception("Failed to update analytics counts for %d events", lost)
+        self.stats["counts_failed"] += lost
+
+    async def _flush(self, batch: list):
+        # Counts are written only for stored events, so they never disagree with the raw events
+        inserted = await self._insert_events(batch)
+        if not inserted:
+            return
+        self.stats["batches"] += 1
+        await self._write_counts(inserted)
@@ -0,0 +1,110 @@
+"""Compare get_products on Mongo against the in-memory columnar catalog.
+
+Seeds a scratch collection with synthetic products, runs every non-search
+query shape through both paths, checks the results agree and prints timings.
+
+Usage: python backend/benchmark_catalog.py [--products N] [--rounds N] [--keep]
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from catalog_engine import ColumnarCatalog
+from server import PRODUCT_QUERY_SHAPES, build_product_query, client, db
+
+BENCH_COLLECTION = "products_benchmark"
+CATEGORIES = ["Power Tools", "Hand Tools", "Fasteners", "Plumbing", "Electrical", "Paint", "Lumber", "Hardware"]
+
+
+def make_products(count):
+    start = datetime.now(timezone.utc) - timedelta(days=365)
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "name": f"Product {i}",
+            "description": f"Synthetic product {i}",
+            "price": round(random.uniform(1, 500), 2),
+            "category": random.choice(CATEGORIES),
+            "imageUrl": "https://example.com/product.jpg",
+            "stock": random.choice([0, random.randint(1, 9), random.randint(10, 200)]),
+            "version": 1,
+            "createdAt": (start + timedelta(seconds=random.randint(0, 365 * 86400))).isoformat(),
+        }
+        for i in range(count)
+    ]
+
+
+def query_cases():
+    for min_price, max_price in PRODUCT_QUERY_SHAPES["price"]:
+        for category in [None, CATEGORIES[0]]:
+            for stock_status in PRODUCT_QUERY_SHAPES["stock_status"]:
+                for sort_by in PRODUCT_QUERY_SHAPES["sort_by"]:
+                    yield {
+                        "category": category,
+                        "min_price": min_price,
+                        "max_price": max_price,
+                        "stock_status": stock_status,
+                        "sort_by": sort_by,
+                    }
+
+
+def results_match(mongo_rows, engine_rows, sort_by):
+    # Ties on the sort key may come back in a different order, so compare key sequences and id sets
+    field = "price" if sort_by in ("price_asc", "price_desc") else "createdAt"
+    if [r[field] for r in mongo_rows] != [r[field] for r in engine_rows]:
+        return False
+    if len(mongo_rows) < 1000:
+        return {r["id"] for r in mongo_rows} == {r["id"] for r in engine_rows}
+    return True
+
+
+async def main(args):
+    collection = db[BENCH_COLLECTION]
+    await collection.drop()
+    await collection.insert_many(make_products(args.products))
+
+    started = time.perf_counter()
+    catalog = ColumnarCatalog()
+    await catalog.load(collection)
+    print(f"Loaded {len(catalog)} products into the columnar catalog in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    mongo_total = engine_total = 0.0
+    mismatches = 0
+    for case in query_cases():
+        query, sort_order = build_product_query(search=None, **case)
+
+        started = time.perf_counter()
+        for _ in range(args.rounds):
+            mongo_rows = await collection.find(query, {"_id": 0}).sort(sort_order).to_list(1000)
+        mongo_ms = (time.perf_counter() - started) * 1000 / args.rounds
+
+        started = time.perf_counter()
+        for _ in range(args.rounds):
+            engine_rows = catalog.query(**case)
+        engine_ms = (time.perf_counter() - started) * 1000 / args.rounds
+
+        mongo_total += mongo_ms
+        engine_total += engine_ms
+        if not results_match(mongo_rows, engine_rows, case["sort_by"]):
+            mismatches += 1
+            print(f"MISMATCH {case}")
+
+        print(f"{mongo_ms:>9.2f} ms {engine_ms:>9.2f} ms {len(engine_rows):>5}  {case}")
+
+    print(f"\nMongo total: {mongo_total:.1f} ms, columnar total: {engine_total:.1f} ms, "
+          f"speedup {mongo_total / max(engine_total, 1e-9):.1f}x, mismatches: {mismatches}")
+
+    if not args.keep:
+        await collection.drop()
+    client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=100000, help="number of synthetic products")
+    parser.add_argument("--rounds", type=int, default=5, help="timed runs per query shape")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch collection afterwards")
+    asyncio.run(main(parser.parse_args()))
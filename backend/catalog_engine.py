@@ -0,0 +1,192 @@
+"""In-memory columnar product catalog.
+
+Holds every product as NumPy columns (price, stock, createdAt, category code)
+next to a plain row list, and answers the non-search get_products filters with
+vectorized masks and stable argsorts. Results match the Mongo path: same
+filters, same sort keys, same 1000 document cap.
+
+The catalog is per-process. It is loaded on startup and kept current by the
+product write routes. Writes from other workers or from outside the API are
+picked up by resync(), which reloads when the product count or version sum in
+Mongo no longer matches the catalog.
+"""
+from typing import List, Optional
+
+import numpy as np
+
+# createdAt is compared as a string, exactly like Mongo sorts it
+CREATED_AT_DTYPE = "U64"
+
+# Mongo's stock filters never match a missing stock field, and no band matches a negative value
+MISSING_STOCK = -1
+
+
+class ColumnarCatalog:
+    def __init__(self, capacity: int = 1024):
+        self.loaded = False
+        self._pending = None
+        self._reset(capacity)
+
+    def _reset(self, capacity: int):
+        self._size = 0
+        self._dead = 0
+        self._ids = {}
+        self._deleted = set()
+        self._rows = []
+        self._category_codes = {}
+        self._price = np.empty(capacity, dtype=np.float64)
+        self._stock = np.empty(capacity, dtype=np.int64)
+        self._created = np.empty(capacity, dtype=CREATED_AT_DTYPE)
+        self._category = np.empty(capacity, dtype=np.int32)
+        self._alive = np.zeros(capacity, dtype=bool)
+
+    def __len__(self):
+        return self._size - self._dead
+
+    async def load(self, collection):
+        # Build a fresh catalog and swap it in, so queries never see a half-loaded one
+        fresh = ColumnarCatalog(max(1024, await collection.estimated_document_count()))
+        self._pending = []
+        try:
+            async for doc in collection.find({}, {"_id": 0}):
+                fresh.upsert(doc)
+            # Writes made while loading may be missing from the scan; versions make replaying them safe
+            for method, arg in self._pending:
+                getattr(fresh, method)(arg)
+        finally:
+            self._pending = None
+        fresh.loaded = True
+        self.__dict__.update(fresh.__dict__)
+
+    def signature(self) -> tuple:
+        return len(self), sum(row.get("version", 1) for row in self._rows if row is not None)
+
+    async def resync(self, collection) -> bool:
+        # Every write through the API bumps a version, so count plus version sum detects outside changes
+        result = await collection.aggregate([
+            {"$group": {"_id": None, "count": {"$sum": 1}, "versions": {"$sum": {"$ifNull": ["$version", 1]}}}}
+        ]).to_list(1)
+        remote = (result[0]["count"], result[0]["versions"]) if result else (0, 0)
+        if remote == self.signature():
+            return False
+        await self.load(collection)
+        return True
+
+    def _grow(self):
+        capacity = len(self._alive) * 2
+        for name in ("_price", "_stock", "_created", "_category"):
+            column = getattr(self, name)
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            setattr(self, name, grown)
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self._size] = self._alive[:self._size]
+        self._alive = alive
+
+    def _category_code(self, category: str) -> int:
+        code = self._category_codes.get(category)
+        if code is None:
+            code = self._category_codes[category] = len(self._category_codes)
+        return code
+
+    def upsert(self, doc: dict):
+        # Writes can finish out of order, so only a newer version replaces a row and deleted ids stay deleted
+        row = {k: v for k, v in doc.items() if k != "_id"}
+        if self._pending is not None:
+            self._pending.append(("upsert", row))
+        if row["id"] in self._deleted:
+            return
+        idx = self._ids.get(row["id"])
+        if idx is not None and self._rows[idx].get("version", 1) >= row.get("version", 1):
+            return
+        if idx is None:
+            if self._size == len(self._alive):
+                self._grow()
+            idx = self._size
+            self._size += 1
+            self._ids[row["id"]] = idx
+            self._rows.append(None)
+
+        self._rows[idx] = row
+        self._price[idx] = row["price"]
+        stock = row.get("stock")
+        self._stock[idx] = MISSING_STOCK if stock is None else stock
+        self._created[idx] = row["createdAt"]
+        self._category[idx] = self._category_code(row["category"])
+        self._alive[idx] = True
+
+    def remove(self, product_id: str):
+        # Product ids are never reused, so the tombstone can be kept for the life of the catalog
+        if self._pending is not None:
+            self._pending.append(("remove", product_id))
+        self._deleted.add(product_id)
+        idx = self._ids.pop(product_id, None)
+        if idx is None:
+            return
+        self._rows[idx] = None
+        self._alive[idx] = False
+        self._dead += 1
+        if self._dead > 1024 and self._dead * 2 > self._size:
+            self._compact()
+
+    def _compact(self):
+        # Drop deleted rows while keeping insertion order, which Mongo ties follow
+        keep = np.flatnonzero(self._alive[:self._size])
+        for name in ("_price", "_stock", "_created", "_category", "_alive"):
+            column = getattr(self, name)
+            compacted = np.zeros(len(column), dtype=column.dtype)
+            compacted[:len(keep)] = column[keep]
+            setattr(self, name, compacted)
+        self._rows = [self._rows[i] for i in keep]
+        self._ids = {row["id"]: i for i, row in enumerate(self._rows)}
+        self._size = len(keep)
+        self._dead = 0
+
+    def query(
+        self,
+        category: Optional[str] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        stock_status: Optional[str] = None,
+        sort_by: Optional[str] = None,
+        limit: int = 1000
+    ) -> List[dict]:
+        n = self._size
+        mask = self._alive[:n].copy()
+
+        if category:
+            code = self._category_codes.get(category)
+            if code is None:
+                return []
+            mask &= self._category[:n] == code
+
+        price = self._price[:n]
+        if min_price is not None:
+            mask &= price >= min_price
+        if max_price is not None:
+            mask &= price <= max_price
+
+        stock = self._stock[:n]
+        if stock_status == "in_stock":
+            mask &= stock >= 10
+        elif stock_status == "low_stock":
+            mask &= (stock > 0) & (stock < 10)
+        elif stock_status == "out_of_stock":
+            mask &= stock == 0
+
+        idx = np.flatnonzero(mask)
+        if sort_by == "price_asc":
+            idx = idx[np.argsort(price[idx], kind="stable")]
+        elif sort_by == "price_desc":
+            idx = sort_descending(idx, price)
+        else:
+            idx = sort_descending(idx, self._created[:n])
+
+        rows = self._rows
+        return [rows[i] for i in idx[:limit]]
+
+
+def sort_descending(idx: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    # Stable descending sort that keeps ties in insertion order; works for string keys too
+    reversed_idx = idx[::-1]
+    return reversed_idx[np.argsort(keys[reversed_idx], kind="stable")][::-1]
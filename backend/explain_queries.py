@@ -0,0 +1,48 @@
+"""Explain every get_products query shape against the live products collection.
+
+Usage: python backend/explain_queries.py [--json] [--problems-only]
+"""
+import argparse
+import asyncio
+import json
+
+from server import client, run_product_query_plans
+
+
+def print_table(reports):
+    print(f"{'examined':>9} {'returned':>9} {'ms':>6}  {'plan':<28} shape")
+    for report in reports:
+        flags = []
+        if report["collscan"]:
+            flags.append("COLLSCAN")
+        if report["in_memory_sort"]:
+            flags.append("SORT")
+        plan = ",".join(report["indexes"]) or "-"
+        if flags:
+            plan = f"{plan} [{'+'.join(flags)}]"
+        print(
+            f"{report['docs_examined']:>9} {report['returned']:>9} {report['execution_ms']:>6}  "
+            f"{plan:<28} {report['shape']}"
+        )
+
+
+async def main(args):
+    try:
+        reports = await run_product_query_plans()
+    finally:
+        client.close()
+
+    if args.problems_only:
+        reports = [r for r in reports if r["collscan"] or r["in_memory_sort"]]
+
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        print_table(reports)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--json", action="store_true", help="print raw reports as JSON")
+    parser.add_argument("--problems-only", action="store_true", help="only show COLLSCAN or in-memory SORT shapes")
+    asyncio.run(main(parser.parse_args()))
@@ -2,15 +2,20 @@ from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, Depend
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
 import os
 import logging
+import asyncio
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, model_validator
+from typing import List, Literal, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
 import re
+import time
+from collections import deque
 import httpx
+from analytics import EventIngestor
 
 
 ROOT_DIR = Path(__file__).parent
@@ -21,6 +26,25 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
+# Optional in-memory columnar catalog for browse queries (CATALOG_ENGINE=columnar)
+catalog_engine = None
+catalog_resync_task = None
+CATALOG_RESYNC_SECONDS = float(os.environ.get('CATALOG_RESYNC_SECONDS', 10))
+if os.environ.get('CATALOG_ENGINE') == 'columnar':
+    from catalog_engine import ColumnarCatalog
+    catalog_engine = ColumnarCatalog()
+
+# Analytics events are queued in-process and written to Mongo in batches
+event_ingestor = EventIngestor(
+    db.analytics_events,
+    db.analytics_counts,
+    max_queue=int(os.environ.get('ANALYTICS_QUEUE_SIZE', 10000)),
+    batch_size=int(os.environ.get('ANALYTICS_BATCH_SIZE', 500)),
+    flush_interval=float(os.environ.get('ANALYTICS_FLUSH_SECONDS', 1.0)),
+    bucket_seconds=int(os.environ.get('ANALYTICS_BUCKET_SECONDS', 3600)),
+    events_ttl_seconds=int(os.environ['ANALYTICS_EVENTS_TTL_SECONDS']) if os.environ.get('ANALYTICS_EVENTS_TTL_SECONDS') else None
+)
+
 # Create the main app without a prefix
 app = FastAPI()
 
@@ -28,6 +52,10 @@ app = FastAPI()
 api_router = APIRouter(prefix="/api")
 
 
+# Versions are stored as BSON int64
+MAX_VERSION = 2**63 - 1
+
+
 # Define Models
 class User(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -54,6 +82,7 @@ class Category(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
     description: Optional[str] = ""
+    version: int = 1
     createdAt: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
 class CategoryCreate(BaseModel):
@@ -63,6 +92,7 @@ class CategoryCreate(BaseModel):
 class CategoryUpdate(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
+    expected_version: Optional[int] = Field(default=None, ge=1, le=MAX_VERSION)
 
 class Product(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -74,6 +104,7 @@ class Product(BaseModel):
     category: str
     imageUrl: str
     stock: int = 0
+    version: int = 1
     createdAt: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
 class ProductCreate(BaseModel):
@@ -91,11 +122,30 @@ class ProductUpdate(BaseModel):
     category: Optional[str] = None
     imageUrl: Optional[str] = None
     stock: Optional[int] = None
+    expected_version: Optional[int] = Field(default=None, ge=1, le=MAX_VERSION)
 
 class AdminUpdate(BaseModel):
     email: str
     is_admin: bool
 
+class AnalyticsEvent(BaseModel):
+    type: Literal["product_view", "search", "add_to_cart"]
+    product_id: Optional[str] = Field(default=None, max_length=64)
+    term: Optional[str] = Field(default=None, max_length=100)
+
+    @model_validator(mode="after")
+    def check_key(self):
+        # Events are counted by product_id, or by term for searches, so the key must be present
+        if self.type == "search":
+            if not self.term or not self.term.strip():
+                raise ValueError("search events require a term")
+        elif not self.product_id:
+            raise ValueError(f"{self.type} events require a product_id")
+        return self
+
+class AnalyticsEventBatch(BaseModel):
+    events: List[AnalyticsEvent] = Field(max_length=100)
+
 
 # Auth Helper Functions
 async def get_current_user(request: Request) -> Optional[User]:
@@ -138,6 +188,167 @@ async def require_admin(request: Request) -> User:
     return user
 
 
+# Optimistic Concurrency Helpers
+def format_etag(version: int) -> str:
+    return f'"{version}"'
+
+def get_expected_versions(request: Request, body_version: Optional[int]) -> Optional[List[int]]:
+    # If-Match header takes precedence over expected_version in the body
+    if_match = request.headers.get("If-Match")
+    if not if_match or if_match.strip() == "*":
+        return None if body_version is None else [body_version]
+    
+    # If-Match uses strong comparison, so weak or unparseable tags can never match
+    versions = []
+    for tag in if_match.split(","):
+        match = re.fullmatch(r'"(\d+)"', tag.strip(), re.ASCII)
+        if match and int(match.group(1)) <= MAX_VERSION:
+            versions.append(int(match.group(1)))
+    return versions
+
+async def versioned_update(collection, doc_id: str, update_data: dict, expected_versions: Optional[List[int]], not_found: str):
+    query = {"id": doc_id}
+    if expected_versions is not None:
+        query["version"] = {"$in": expected_versions}
+    
+    updated = await collection.find_one_and_update(
+        query,
+        {"$set": update_data, "$inc": {"version": 1}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if updated:
+        return updated
+    
+    # Only reached on failure: tell a missing document apart from a stale version
+    if expected_versions is not None and await collection.count_documents({"id": doc_id}, limit=1):
+        raise HTTPException(status_code=412, detail="Version conflict: resource was modified by another request")
+    raise HTTPException(status_code=404, detail=not_found)
+
+
+# Query Diagnostics Helpers
+# Set SLOW_QUERY_MS to log any product query slower than that many milliseconds
+SLOW_QUERY_MS = float(os.environ['SLOW_QUERY_MS']) if os.environ.get('SLOW_QUERY_MS') else None
+slow_queries = deque(maxlen=200)
+
+PRODUCT_QUERY_SHAPES = {
+    "search": [None, "tool"],
+    "category": [None, "__sample__"],
+    "price": [(None, None), (10.0, None), (None, 100.0), (10.0, 100.0)],
+    "stock_status": [None, "in_stock", "low_stock", "out_of_stock"],
+    "sort_by": ["newest", "price_asc", "price_desc"],
+}
+
+def normalize_query_shape(value):
+    # Replace literal values with "?" so queries differing only in parameters share a shape
+    if isinstance(value, dict):
+        return {k: normalize_query_shape(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize_query_shape(v) for v in value]
+    return "?"
+
+def describe_query_shape(query: dict, sort_order: list) -> str:
+    shape = normalize_query_shape(query)
+    sort = ",".join(f"{field}:{direction}" for field, direction in sort_order)
+    return f"{shape} sort={sort or 'none'}"
+
+def record_slow_query(collection_name: str, query: dict, sort_order: list, elapsed_ms: float, returned: int):
+    if SLOW_QUERY_MS is None or elapsed_ms < SLOW_QUERY_MS:
+        return
+    
+    entry = {
+        "collection": collection_name,
+        "shape": describe_query_shape(query, sort_order),
+        "elapsed_ms": round(elapsed_ms, 2),
+        "returned": returned,
+        "at": datetime.now(timezone.utc).isoformat()
+    }
+    slow_queries.append(entry)
+    logging.getLogger(__name__).warning(
+        "Slow query on %s (%.1f ms, %d docs): %s",
+        collection_name, elapsed_ms, returned, entry["shape"]
+    )
+
+def summarize_plan(plan: dict, stages: list, indexes: list):
+    # Walk the winning plan tree collecting stage names and index names
+    if not plan:
+        return
+    if "queryPlan" in plan:
+        plan = plan["queryPlan"]
+    stages.append(plan.get("stage"))
+    if plan.get("indexName"):
+        indexes.append(plan["indexName"])
+    if "inputStage" in plan:
+        summarize_plan(plan["inputStage"], stages, indexes)
+    for child in plan.get("inputStages", []):
+        summarize_plan(child, stages, indexes)
+
+async def explain_product_query(query: dict, sort_order: list) -> dict:
+    result = await db.command({
+        "explain": {
+            "find": "products",
+            "filter": query,
+            "projection": {"_id": 0},
+            "sort": dict(sort_order),
+            "limit": 1000
+        },
+        "verbosity": "executionStats"
+    })
+    
+    stages, indexes = [], []
+    summarize_plan(result.get("queryPlanner", {}).get("winningPlan", {}), stages, indexes)
+    stats = result.get("executionStats", {})
+    
+    return {
+        "shape": describe_query_shape(query, sort_order),
+        "stages": stages,
+        "indexes": indexes,
+        "collscan": "COLLSCAN" in stages,
+        "in_memory_sort": "SORT" in stages,
+        "docs_examined": stats.get("totalDocsExamined", 0),
+        "keys_examined": stats.get("totalKeysExamined", 0),
+        "returned": stats.get("nReturned", 0),
+        "execution_ms": stats.get("executionTimeMillis", 0)
+    }
+
+async def run_product_query_plans() -> List[dict]:
+    # Use a real category so category filters examine representative documents
+    sample = await db.products.find_one({}, {"_id": 0, "category": 1})
+    sample_category = sample["category"] if sample else "sample"
+    
+    reports = []
+    seen_shapes = set()
+    for search in PRODUCT_QUERY_SHAPES["search"]:
+        for category in PRODUCT_QUERY_SHAPES["category"]:
+            for min_price, max_price in PRODUCT_QUERY_SHAPES["price"]:
+                for stock_status in PRODUCT_QUERY_SHAPES["stock_status"]:
+                    for sort_by in PRODUCT_QUERY_SHAPES["sort_by"]:
+                        query, sort_order = build_product_query(
+                            search,
+                            sample_category if category else None,
+                            min_price,
+                            max_price,
+                            stock_status,
+                            sort_by
+                        )
+                        shape = describe_query_shape(query, sort_order)
+                        if shape in seen_shapes:
+                            continue
+                        seen_shapes.add(shape)
+                        
+                        report = await explain_product_query(query, sort_order)
+                        report["params"] = {
+                            "search": search,
+                            "category": sample_category if category else None,
+                            "min_price": min_price,
+                            "max_price": max_price,
+                            "stock_status": stock_status,
+                            "sort_by": sort_by
+                        }
+                        reports.append(report)
+    return reports
+
+
 # Auth Routes
 @api_router.post("/auth/session")
 async def create_session(request: Request, response: Response):
@@ -257,6 +468,35 @@ async def update_user_admin_status(
     return {"message": "User admin status updated"}
 
 
+# Diagnostics Routes (Admin Protected)
+@api_router.get("/admin/diagnostics/query-plans")
+async def get_query_plans(request: Request, current_user: User = Depends(require_admin)):
+    return await run_product_query_plans()
+
+@api_router.get("/admin/diagnostics/slow-queries")
+async def get_slow_queries(request: Request, current_user: User = Depends(require_admin)):
+    return {"threshold_ms": SLOW_QUERY_MS, "queries": list(slow_queries)}
+
+
+@api_router.get("/admin/analytics/ingestion")
+async def get_ingestion_stats(request: Request, current_user: User = Depends(require_admin)):
+    return event_ingestor.snapshot()
+
+
+# Analytics Routes
+@api_router.post("/events", status_code=202)
+async def ingest_events(batch: AnalyticsEventBatch):
+    # All or nothing, so a client retrying after 429 never double counts
+    events = [(e.type, e.product_id, e.term) for e in batch.events]
+    if not event_ingestor.offer_many(events):
+        raise HTTPException(
+            status_code=429,
+            detail=f"Event queue full: {len(events)} events dropped",
+            headers={"Retry-After": "1"}
+        )
+    return {"accepted": len(events)}
+
+
 # Category Routes (Admin Protected)
 @api_router.post("/categories", response_model=Category)
 async def create_category(category: CategoryCreate, request: Request, current_user: User = Depends(require_admin)):
@@ -272,23 +512,22 @@ async def get_categories():
     return categories
 
 @api_router.get("/categories/{category_id}", response_model=Category)
-async def get_category(category_id: str):
+async def get_category(category_id: str, response: Response):
     category = await db.categories.find_one({"id": category_id}, {"_id": 0})
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
+    response.headers["ETag"] = format_etag(category.get("version", 1))
     return category
 
 @api_router.put("/categories/{category_id}", response_model=Category)
-async def update_category(category_id: str, category_update: CategoryUpdate, request: Request, current_user: User = Depends(require_admin)):
-    update_data = {k: v for k, v in category_update.model_dump().items() if v is not None}
+async def update_category(category_id: str, category_update: CategoryUpdate, request: Request, response: Response, current_user: User = Depends(require_admin)):
+    update_data = {k: v for k, v in category_update.model_dump(exclude={"expected_version"}).items() if v is not None}
     if not update_data:
         raise HTTPException(status_code=400, detail="No fields to update")
     
-    result = await db.categories.update_one({"id": category_id}, {"$set": update_data})
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Category not found")
-    
-    updated_category = await db.categories.find_one({"id": category_id}, {"_id": 0})
+    expected_versions = get_expected_versions(request, category_update.expected_version)
+    updated_category = await versioned_update(db.categories, category_id, update_data, expected_versions, "Category not found")
+    response.headers["ETag"] = format_etag(updated_category["version"])
     return updated_category
 
 @api_router.delete("/categories/{category_id}")
@@ -306,10 +545,11 @@ async def create_product(product: ProductCreate, request: Request, current_user:
     product_obj = Product(**product_dict)
     doc = product_obj.model_dump()
     await db.products.insert_one(doc)
+    if catalog_engine is not None:
+        catalog_engine.upsert(doc)
     return product_obj
 
-@api_router.get("/products", response_model=List[Product])
-async def get_products(
+def build_product_query(
     search: Optional[str] = None,
     category: Optional[str] = None,
     min_price: Optional[float] = None,
@@ -360,27 +600,47 @@ async def get_products(
     else:
         sort_order = [("createdAt", -1)]
     
+    return query, sort_order
+
+@api_router.get("/products", response_model=List[Product])
+async def get_products(
+    search: Optional[str] = None,
+    category: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    stock_status: Optional[str] = None,
+    sort_by: Optional[str] = None
+):
+    # Search needs regex matching, so only the plain filters are served from memory
+    if catalog_engine is not None and catalog_engine.loaded and not search:
+        return catalog_engine.query(category, min_price, max_price, stock_status, sort_by)
+    
+    query, sort_order = build_product_query(search, category, min_price, max_price, stock_status, sort_by)
+    
+    started = time.perf_counter()
     products = await db.products.find(query, {"_id": 0}).sort(sort_order).to_list(1000)
+    record_slow_query("products", query, sort_order, (time.perf_counter() - started) * 1000, len(products))
     return products
 
 @api_router.get("/products/{product_id}", response_model=Product)
-async def get_product(product_id: str):
+async def get_product(product_id: str, response: Response):
     product = await db.products.find_one({"id": product_id}, {"_id": 0})
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
+    response.headers["ETag"] = format_etag(product.get("version", 1))
     return product
 
 @api_router.put("/products/{product_id}", response_model=Product)
-async def update_product(product_id: str, product_update: ProductUpdate, request: Request, current_user: User = Depends(require_admin)):
-    update_data = {k: v for k, v in product_update.model_dump().items() if v is not None}
+async def update_product(product_id: str, product_update: ProductUpdate, request: Request, response: Response, current_user: User = Depends(require_admin)):
+    update_data = {k: v for k, v in product_update.model_dump(exclude={"expected_version"}).items() if v is not None}
     if not update_data:
         raise HTTPException(status_code=400, detail="No fields to update")
     
-    result = await db.products.update_one({"id": product_id}, {"$set": update_data})
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Product not found")
-    
-    updated_product = await db.products.find_one({"id": product_id}, {"_id": 0})
+    expected_versions = get_expected_versions(request, product_update.expected_version)
+    updated_product = await versioned_update(db.products, product_id, update_data, expected_versions, "Product not found")
+    if catalog_engine is not None:
+        catalog_engine.upsert(updated_product)
+    response.headers["ETag"] = format_etag(updated_product["version"])
     return updated_product
 
 @api_router.delete("/products/{product_id}")
@@ -388,6 +648,8 @@ async def delete_product(product_id: str, request: Request, current_user: User =
     result = await db.products.delete_one({"id": product_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    if catalog_engine is not None:
+        catalog_engine.remove(product_id)
     return {"message": "Product deleted successfully"}
 
 
@@ -400,6 +662,7 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 # Configure logging
@@ -409,6 +672,49 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def backfill_versions():
+    # Documents created before versioning start at version 1 so If-Match checks can match them
+    for collection in (db.products, db.categories):
+        await collection.update_many({"version": {"$exists": False}}, {"$set": {"version": 1}})
+
+async def resync_catalog_engine():
+    # Picks up writes made by other workers or outside the API
+    while True:
+        await asyncio.sleep(CATALOG_RESYNC_SECONDS)
+        try:
+            if await catalog_engine.resync(db.products):
+                logger.warning("Columnar catalog was out of date with Mongo; reloaded %d products", len(catalog_engine))
+        except Exception:
+            logger.exception("Failed to resync columnar catalog")
+
+@app.on_event("startup")
+async def load_catalog_engine():
+    global catalog_resync_task
+    if catalog_engine is None:
+        return
+    
+    if int(os.environ.get('WEB_CONCURRENCY', 1)) > 1:
+        logger.warning(
+            "CATALOG_ENGINE=columnar with multiple workers: other workers' writes show up only after "
+            "the next resync (every %.0f s)", CATALOG_RESYNC_SECONDS
+        )
+    await catalog_engine.load(db.products)
+    logger.info("Columnar catalog loaded with %d products", len(catalog_engine))
+    catalog_resync_task = asyncio.create_task(resync_catalog_engine())
+
+@app.on_event("startup")
+async def start_event_ingestor():
+    # Analytics must never keep the API from starting
+    try:
+        await event_ingestor.ensure_indexes()
+    except Exception:
+        logger.exception("Failed to create analytics indexes")
+    event_ingestor.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    if catalog_resync_task is not None:
+        catalog_resync_task.cancel()
+    await event_ingestor.stop()
     client.close()
@@ -1,7 +1,18 @@
+import { useEffect } from "react";
+import axios from "axios";
 import { X, ShoppingCart } from "lucide-react";
 import { Button } from "@/components/ui/button";
 
+const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
+
 const ProductModal = ({ product, onClose, onOrder }) => {
+  useEffect(() => {
+    // Fire-and-forget analytics; a full queue or network error must not affect the modal
+    axios.post(`${API}/events`, {
+      events: [{ type: "product_view", product_id: product.id }]
+    }).catch(() => {});
+  }, [product.id]);
+
   return (
     <div
       className="fixed inset-0 z-50 flex items-center justify-center p-4 bg-black/80 backdrop-blur-sm"
@@ -1,6 +1,9 @@
 import React, { createContext, useContext, useReducer, useEffect } from 'react';
+import axios from 'axios';
 import { toast } from 'sonner';
 
+const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
+
 // Cart Context for managing shopping cart state globally
 const CartContext = createContext();
 
@@ -150,6 +153,11 @@ export const CartProvider = ({ children }) => {
     });
 
     toast.success(`${product.name} added to cart`);
+
+    // Fire-and-forget analytics; a full queue or network error must not affect the cart
+    axios.post(`${API}/events`, {
+      events: [{ type: 'add_to_cart', product_id: product.id }]
+    }).catch(() => {});
   };
 
   const removeFromCart = (productId) => {
@@ -116,7 +116,8 @@ const AdminPanel = () => {
         await axios.put(`${API}/products/${editingProduct.id}`, {
           ...productForm,
           price: parseFloat(productForm.price),
-          stock: parseInt(productForm.stock)
+          stock: parseInt(productForm.stock),
+          expected_version: editingProduct.version
         }, { withCredentials: true });
         toast.success("Product updated successfully");
       } else {
@@ -133,7 +134,12 @@ const AdminPanel = () => {
       fetchProducts();
     } catch (error) {
       console.error("Error saving product:", error);
-      toast.error("Failed to save product");
+      if (error.response?.status === 412) {
+        toast.error("This product was changed by someone else. Reload and try again.");
+        fetchProducts();
+      } else {
+        toast.error("Failed to save product");
+      }
     }
   };
 
@@ -141,7 +147,10 @@ const AdminPanel = () => {
     e.preventDefault();
     try {
       if (editingCategory) {
-        await axios.put(`${API}/categories/${editingCategory.id}`, categoryForm, { withCredentials: true });
+        await axios.put(`${API}/categories/${editingCategory.id}`, {
+          ...categoryForm,
+          expected_version: editingCategory.version
+        }, { withCredentials: true });
         toast.success("Category updated successfully");
       } else {
         await axios.post(`${API}/categories`, categoryForm, { withCredentials: true });
@@ -153,7 +162,12 @@ const AdminPanel = () => {
       fetchCategories();
     } catch (error) {
       console.error("Error saving category:", error);
-      toast.error("Failed to save category");
+      if (error.response?.status === 412) {
+        toast.error("This category was changed by someone else. Reload and try again.");
+        fetchCategories();
+      } else {
+        toast.error("Failed to save category");
+      }
     }
   };
 
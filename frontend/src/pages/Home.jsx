@@ -93,6 +93,18 @@ const Home = () => {
     return () => clearTimeout(debounce);
   }, [searchQuery, selectedCategory, priceRange, stockStatus, sortBy]);
 
+  // Record a search once the user stops typing, not on every filter change that refetches it
+  useEffect(() => {
+    const term = searchQuery.trim();
+    if (!term) return;
+    const debounce = setTimeout(() => {
+      axios.post(`${API}/events`, {
+        events: [{ type: "search", term }]
+      }).catch(() => {});
+    }, 1000);
+    return () => clearTimeout(debounce);
+  }, [searchQuery]);
+
   const handleOrderWhatsApp = (product) => {
     const message = `Hi! I'm interested in ordering: ${product.name} - $${product.price}`;
     const phoneNumber = "96171294697";
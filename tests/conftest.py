@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The backend is run as plain modules from its own directory (uvicorn server:app)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
@@ -0,0 +1,278 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError, OperationFailure
+
+import server
+from analytics import EventIngestor
+from server import AnalyticsEvent
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.commands = []
+
+    async def command(self, command):
+        self.commands.append(command)
+
+
+class FakeCollection:
+    name = "fake"
+
+    def __init__(self, indexes=None, failing_indexes=(), error=None):
+        self.inserted = []
+        self.ops = []
+        self.indexes = dict(indexes or {"_id_": {"key": [("_id", 1)]}})
+        self.failing_indexes = set(failing_indexes)
+        self.error = error
+        self.database = FakeDatabase()
+
+    async def insert_many(self, docs, ordered=True):
+        docs = list(docs)
+        if self.error:
+            raise self.error
+        if self.failing_indexes:
+            self.inserted.append([d for i, d in enumerate(docs) if i not in self.failing_indexes])
+            raise BulkWriteError({"writeErrors": [{"index": i} for i in sorted(self.failing_indexes)]})
+        self.inserted.append(docs)
+
+    async def bulk_write(self, ops, ordered=True):
+        if self.error:
+            raise self.error
+        if self.failing_indexes:
+            self.ops.extend(op for i, op in enumerate(ops) if i not in self.failing_indexes)
+            raise BulkWriteError({"writeErrors": [{"index": i} for i in sorted(self.failing_indexes)]})
+        self.ops.extend(ops)
+
+    async def index_information(self):
+        return dict(self.indexes)
+
+    async def create_index(self, keys, **options):
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        name = "_".join(f"{field}_{direction}" for field, direction in keys)
+        existing = self.indexes.get(name)
+        if existing is not None and existing.get("expireAfterSeconds") != options.get("expireAfterSeconds"):
+            raise OperationFailure("Index with name ts_1 already exists with different options", code=85)
+        self.indexes[name] = {"key": keys, **options}
+        return name
+
+    async def drop_index(self, name):
+        del self.indexes[name]
+
+
+def make_ingestor(events=None, counts=None, **kwargs):
+    events = events or FakeCollection()
+    counts = counts or FakeCollection()
+    return EventIngestor(events, counts, **kwargs), events, counts
+
+
+def make_events(count):
+    ts = datetime(2026, 1, 1, 10, tzinfo=timezone.utc)
+    return [{"type": "product_view", "product_id": f"p{i}", "term": None, "ts": ts} for i in range(count)]
+
+
+def test_full_queue_drops_and_counts():
+    async def run():
+        ingestor, _, _ = make_ingestor(max_queue=2)
+        results = [ingestor.offer("product_view", product_id="p1") for _ in range(5)]
+        return results, ingestor.snapshot()
+
+    results, stats = asyncio.run(run())
+    assert results == [True, True, False, False, False]
+    assert stats["accepted"] == 2
+    assert stats["dropped"] == 3
+    assert stats["queued"] == 2
+
+
+def test_offer_many_is_all_or_nothing():
+    async def run():
+        ingestor, _, _ = make_ingestor(max_queue=3)
+        ingestor.offer("product_view", product_id="p1")
+        rejected = ingestor.offer_many([("product_view", "p2", None)] * 3)
+        accepted = ingestor.offer_many([("product_view", "p2", None)] * 2)
+        return rejected, accepted, ingestor.snapshot()
+
+    rejected, accepted, stats = asyncio.run(run())
+    assert not rejected and accepted
+    assert stats["queued"] == 3
+    assert stats["dropped"] == 3
+
+
+def test_flushes_when_batch_size_reached():
+    async def run():
+        ingestor, events, _ = make_ingestor(batch_size=3, flush_interval=30)
+        ingestor.start()
+        for _ in range(3):
+            ingestor.offer("product_view", product_id="p1")
+        await asyncio.sleep(0.05)
+        flushed = [len(batch) for batch in events.inserted]
+        await ingestor.stop()
+        return flushed
+
+    assert asyncio.run(run()) == [3]
+
+
+def test_flushes_when_interval_elapses():
+    async def run():
+        ingestor, events, _ = make_ingestor(batch_size=100, flush_interval=0.05)
+        ingestor.start()
+        ingestor.offer("product_view", product_id="p1")
+        await asyncio.sleep(0.01)
+        before = len(events.inserted)
+        await asyncio.sleep(0.15)
+        after = [len(batch) for batch in events.inserted]
+        await ingestor.stop()
+        return before, after
+
+    before, after = asyncio.run(run())
+    assert before == 0
+    assert after == [1]
+
+
+def test_stop_drains_queue():
+    async def run():
+        ingestor, events, _ = make_ingestor(batch_size=4, flush_interval=30)
+        ingestor.start()
+        for i in range(10):
+            ingestor.offer("add_to_cart", product_id=f"p{i}")
+        await ingestor.stop()
+        return events.inserted, ingestor.snapshot()
+
+    inserted, stats = asyncio.run(run())
+    assert sum(len(batch) for batch in inserted) == 10
+    assert stats["flushed"] == 10
+    assert stats["queued"] == 0
+
+
+def test_aggregate_counts_per_key_and_bucket():
+    ingestor, _, _ = make_ingestor(bucket_seconds=3600)
+    first = datetime(2026, 1, 1, 10, 5, tzinfo=timezone.utc)
+    later = datetime(2026, 1, 1, 10, 55, tzinfo=timezone.utc)
+    next_hour = datetime(2026, 1, 1, 11, 1, tzinfo=timezone.utc)
+    batch = [
+        {"type": "product_view", "product_id": "p1", "term": None, "ts": first},
+        {"type": "product_view", "product_id": "p1", "term": None, "ts": later},
+        {"type": "product_view", "product_id": "p1", "term": None, "ts": next_hour},
+        {"type": "add_to_cart", "product_id": "p1", "term": None, "ts": first},
+        {"type": "search", "product_id": None, "term": "drill", "ts": first},
+    ]
+
+    assert ingestor._aggregate(batch) == {
+        ("product_view", "p1", "2026-01-01T10:00:00+00:00"): 2,
+        ("product_view", "p1", "2026-01-01T11:00:00+00:00"): 1,
+        ("add_to_cart", "p1", "2026-01-01T10:00:00+00:00"): 1,
+        ("search", "drill", "2026-01-01T10:00:00+00:00"): 1,
+    }
+
+
+def test_event_requires_key_for_its_type():
+    AnalyticsEvent(type="search", term="drill")
+    AnalyticsEvent(type="product_view", product_id="p1")
+    for bad in (
+        {"type": "search"},
+        {"type": "search", "term": "   "},
+        {"type": "product_view"},
+        {"type": "add_to_cart", "term": "drill"},
+        {"type": "search", "term": "x" * 101},
+    ):
+        with pytest.raises(ValidationError):
+            AnalyticsEvent(**bad)
+
+
+def test_flush_writes_counts_as_upserts():
+    ingestor, events, counts = make_ingestor()
+    asyncio.run(ingestor._flush(make_events(2)))
+
+    assert [op._filter["key"] for op in counts.ops] == ["p0", "p1"]
+    assert all(op._upsert and op._doc == {"$inc": {"count": 1}} for op in counts.ops)
+    assert ingestor.stats["flushed"] == 2
+    assert ingestor.stats["batches"] == 1
+
+
+def test_partial_insert_counts_only_inserted_events():
+    ingestor, events, counts = make_ingestor(events=FakeCollection(failing_indexes={1}))
+    asyncio.run(ingestor._flush(make_events(3)))
+
+    assert [op._filter["key"] for op in counts.ops] == ["p0", "p2"]
+    assert ingestor.stats["flushed"] == 2
+    assert ingestor.stats["failed"] == 1
+    assert ingestor.stats["counts_failed"] == 0
+
+
+def test_failed_insert_skips_counts():
+    ingestor, events, counts = make_ingestor(events=FakeCollection(error=RuntimeError("down")))
+    asyncio.run(ingestor._flush(make_events(3)))
+
+    assert counts.ops == []
+    assert ingestor.stats["flushed"] == 0
+    assert ingestor.stats["failed"] == 3
+    assert ingestor.stats["batches"] == 0
+
+
+def test_failed_counts_keep_inserted_events_flushed():
+    ingestor, events, counts = make_ingestor(counts=FakeCollection(error=RuntimeError("down")))
+    asyncio.run(ingestor._flush(make_events(3)))
+
+    assert ingestor.stats["flushed"] == 3
+    assert ingestor.stats["failed"] == 0
+    assert ingestor.stats["counts_failed"] == 3
+
+
+def test_partial_counts_failure_counts_lost_events():
+    ingestor, events, counts = make_ingestor(counts=FakeCollection(failing_indexes={0}))
+    batch = make_events(2) + make_events(1)
+    asyncio.run(ingestor._flush(batch))
+
+    # p0 appears twice in the batch, so its failed upsert loses two events
+    assert ingestor.stats["flushed"] == 3
+    assert ingestor.stats["counts_failed"] == 2
+    assert [op._filter["key"] for op in counts.ops] == ["p1"]
+
+
+def test_ensure_indexes_creates_counts_and_ts_indexes():
+    ingestor, events, counts = make_ingestor()
+    asyncio.run(ingestor.ensure_indexes())
+
+    assert counts.indexes["type_1_key_1_bucket_1"]["unique"] is True
+    assert "expireAfterSeconds" not in events.indexes["ts_1"]
+
+
+def test_ensure_indexes_turns_ttl_on_and_off():
+    events = FakeCollection(indexes={"ts_1": {"key": [("ts", 1)]}})
+    ingestor, _, _ = make_ingestor(events=events, events_ttl_seconds=3600)
+    asyncio.run(ingestor.ensure_indexes())
+    assert events.indexes["ts_1"]["expireAfterSeconds"] == 3600
+
+    ingestor, _, _ = make_ingestor(events=events)
+    asyncio.run(ingestor.ensure_indexes())
+    assert "expireAfterSeconds" not in events.indexes["ts_1"]
+
+
+def test_ensure_indexes_changes_ttl_with_collmod():
+    events = FakeCollection(indexes={"ts_1": {"key": [("ts", 1)], "expireAfterSeconds": 60}})
+    ingestor, _, _ = make_ingestor(events=events, events_ttl_seconds=3600)
+    asyncio.run(ingestor.ensure_indexes())
+
+    assert events.database.commands == [{
+        "collMod": "fake",
+        "index": {"keyPattern": {"ts": 1}, "expireAfterSeconds": 3600}
+    }]
+
+
+def test_index_errors_do_not_block_startup(monkeypatch):
+    class ConflictingEvents(FakeCollection):
+        async def index_information(self):
+            raise OperationFailure("IndexOptionsConflict", code=85)
+
+    async def run():
+        ingestor, _, _ = make_ingestor(events=ConflictingEvents())
+        monkeypatch.setattr(server, "event_ingestor", ingestor)
+        await server.start_event_ingestor()
+        started = ingestor._task is not None
+        await ingestor.stop()
+        return started
+
+    assert asyncio.run(run())
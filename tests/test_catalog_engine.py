@@ -0,0 +1,223 @@
+import asyncio
+import random
+from datetime import datetime, timedelta, timezone
+
+from catalog_engine import ColumnarCatalog
+from server import PRODUCT_QUERY_SHAPES
+
+CATEGORIES = ["Power Tools", "Hand Tools", "Fasteners"]
+
+
+def make_products(count, seed=7):
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    return [
+        {
+            "id": f"p{i}",
+            "name": f"Product {i}",
+            "price": float(rng.choice([5, 10, 25.5, 99.99, 100, 250])),
+            "category": rng.choice(CATEGORIES),
+            "stock": rng.choice([0, 1, 9, 10, 50]),
+            "version": 1,
+            # Few distinct timestamps so tie ordering is exercised
+            "createdAt": (start + timedelta(hours=rng.randint(0, 20))).isoformat(),
+        }
+        for i in range(count)
+    ]
+
+
+def reference_query(rows, category=None, min_price=None, max_price=None, stock_status=None, sort_by=None, limit=1000):
+    # Mongo semantics of build_product_query, with ties kept in insertion order
+    def matches(row):
+        stock = row.get("stock")
+        if category and row["category"] != category:
+            return False
+        if min_price is not None and row["price"] < min_price:
+            return False
+        if max_price is not None and row["price"] > max_price:
+            return False
+        if stock_status == "in_stock":
+            return stock is not None and stock >= 10
+        if stock_status == "low_stock":
+            return stock is not None and 0 < stock < 10
+        if stock_status == "out_of_stock":
+            return stock == 0
+        return True
+
+    matched = [row for row in rows if matches(row)]
+    if sort_by == "price_asc":
+        matched = sorted(matched, key=lambda r: r["price"])
+    elif sort_by == "price_desc":
+        matched = sorted(matched, key=lambda r: r["price"], reverse=True)
+    else:
+        matched = sorted(matched, key=lambda r: r["createdAt"], reverse=True)
+    return matched[:limit]
+
+
+def query_cases():
+    for category in [None, CATEGORIES[0], "Unknown"]:
+        for min_price, max_price in PRODUCT_QUERY_SHAPES["price"]:
+            for stock_status in PRODUCT_QUERY_SHAPES["stock_status"]:
+                for sort_by in PRODUCT_QUERY_SHAPES["sort_by"]:
+                    yield {
+                        "category": category,
+                        "min_price": min_price,
+                        "max_price": max_price,
+                        "stock_status": stock_status,
+                        "sort_by": sort_by,
+                    }
+
+
+def assert_matches_reference(catalog, rows):
+    for case in query_cases():
+        expected = [r["id"] for r in reference_query(rows, **case)]
+        actual = [r["id"] for r in catalog.query(**case)]
+        assert actual == expected, case
+
+
+def test_query_matches_reference_with_growth():
+    products = make_products(1500)
+    catalog = ColumnarCatalog(capacity=2)
+    for product in products:
+        catalog.upsert(product)
+
+    assert len(catalog) == 1500
+    assert_matches_reference(catalog, products)
+
+
+def test_query_matches_reference_after_compaction():
+    products = make_products(3000)
+    catalog = ColumnarCatalog()
+    for product in products:
+        catalog.upsert(product)
+
+    removed = {p["id"] for p in random.Random(3).sample(products, 2000)}
+    for product_id in removed:
+        catalog.remove(product_id)
+
+    remaining = [p for p in products if p["id"] not in removed]
+    assert catalog._dead < len(removed)
+    assert len(catalog) == len(remaining)
+    assert_matches_reference(catalog, remaining)
+
+    extra = make_products(10, seed=11)
+    for i, product in enumerate(extra):
+        product["id"] = f"extra{i}"
+        catalog.upsert(product)
+    assert_matches_reference(catalog, remaining + extra)
+
+
+def test_missing_stock_matches_no_stock_band():
+    products = make_products(20)
+    del products[3]["stock"]
+    products[4]["stock"] = None
+    catalog = ColumnarCatalog()
+    for product in products:
+        catalog.upsert(product)
+
+    for status in ("in_stock", "low_stock", "out_of_stock"):
+        ids = [r["id"] for r in catalog.query(stock_status=status)]
+        assert "p3" not in ids and "p4" not in ids
+    assert_matches_reference(catalog, products)
+
+
+def test_stale_version_does_not_overwrite():
+    product = make_products(1)[0]
+    catalog = ColumnarCatalog()
+    catalog.upsert(product)
+    catalog.upsert({**product, "price": 1.0, "version": 3})
+    catalog.upsert({**product, "price": 2.0, "version": 2})
+
+    assert catalog.query()[0]["price"] == 1.0
+    assert catalog.query()[0]["version"] == 3
+
+
+def test_late_upsert_after_remove_is_ignored():
+    product = make_products(1)[0]
+    catalog = ColumnarCatalog()
+    catalog.upsert(product)
+    catalog.remove(product["id"])
+    catalog.upsert({**product, "version": 2})
+
+    assert catalog.query() == []
+    assert len(catalog) == 0
+
+
+class FakeCursor:
+    def __init__(self, docs, on_first=None):
+        self.docs = docs
+        self.on_first = on_first
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for i, doc in enumerate(self.docs):
+            if i == 1 and self.on_first:
+                self.on_first()
+            yield dict(doc)
+
+    async def to_list(self, length):
+        return self.docs[:length]
+
+
+class FakeProducts:
+    def __init__(self, docs):
+        self.docs = [dict(doc) for doc in docs]
+        self.during_load = None
+
+    async def estimated_document_count(self):
+        return len(self.docs)
+
+    def find(self, query, projection):
+        return FakeCursor(list(self.docs), self.during_load)
+
+    def aggregate(self, pipeline):
+        if not self.docs:
+            return FakeCursor([])
+        versions = sum(doc.get("version", 1) for doc in self.docs)
+        return FakeCursor([{"_id": None, "count": len(self.docs), "versions": versions}])
+
+
+def test_resync_noop_when_in_sync():
+    products = FakeProducts(make_products(50))
+    catalog = ColumnarCatalog()
+    asyncio.run(catalog.load(products))
+
+    assert catalog.loaded
+    assert asyncio.run(catalog.resync(products)) is False
+
+
+def test_resync_reloads_after_outside_writes():
+    products = FakeProducts(make_products(50))
+    catalog = ColumnarCatalog()
+    asyncio.run(catalog.load(products))
+
+    # Another worker updates one product and deletes another
+    products.docs[0] = {**products.docs[0], "price": 1.0, "version": 2}
+    del products.docs[1]
+
+    assert asyncio.run(catalog.resync(products)) is True
+    assert len(catalog) == 49
+    assert_matches_reference(catalog, products.docs)
+    assert asyncio.run(catalog.resync(products)) is False
+
+
+def test_writes_during_load_are_replayed():
+    docs = make_products(20)
+    products = FakeProducts(docs)
+    catalog = ColumnarCatalog()
+    asyncio.run(catalog.load(products))
+
+    reloaded = [{**docs[0], "price": 1.0, "version": 2}] + docs[2:]
+
+    def route_writes():
+        # The scan below started before these writes were committed
+        catalog.upsert(reloaded[0])
+        catalog.remove(docs[1]["id"])
+
+    products.during_load = route_writes
+    asyncio.run(catalog.load(products))
+
+    assert len(catalog) == 19
+    assert_matches_reference(catalog, reloaded)
@@ -0,0 +1,143 @@
+import asyncio
+import re
+
+import pytest
+
+import server
+from server import build_product_query, describe_query_shape, explain_product_query, record_slow_query, summarize_plan
+
+CLASSIC_COLLSCAN_SORT = {
+    "queryPlanner": {
+        "winningPlan": {
+            "stage": "PROJECTION_SIMPLE",
+            "inputStage": {
+                "stage": "SORT",
+                "inputStage": {"stage": "COLLSCAN", "direction": "forward"}
+            }
+        }
+    },
+    "executionStats": {"nReturned": 3, "totalDocsExamined": 120, "totalKeysExamined": 0, "executionTimeMillis": 4}
+}
+
+WRAPPED_INDEX_OR = {
+    "queryPlanner": {
+        "winningPlan": {
+            "queryPlan": {
+                "stage": "FETCH",
+                "inputStage": {
+                    "stage": "OR",
+                    "inputStages": [
+                        {"stage": "IXSCAN", "indexName": "category_1"},
+                        {"stage": "IXSCAN", "indexName": "price_1"}
+                    ]
+                }
+            },
+            "slotBasedPlan": {"stages": "..."}
+        }
+    },
+    "executionStats": {"nReturned": 5, "totalDocsExamined": 5, "totalKeysExamined": 7, "executionTimeMillis": 1}
+}
+
+
+class FakeDatabase:
+    def __init__(self, result):
+        self.result = result
+        self.commands = []
+
+    async def command(self, command):
+        self.commands.append(command)
+        return self.result
+
+
+def test_summarize_plan_walks_classic_plan():
+    stages, indexes = [], []
+    summarize_plan(CLASSIC_COLLSCAN_SORT["queryPlanner"]["winningPlan"], stages, indexes)
+    assert stages == ["PROJECTION_SIMPLE", "SORT", "COLLSCAN"]
+    assert indexes == []
+
+
+def test_summarize_plan_unwraps_query_plan_and_input_stages():
+    stages, indexes = [], []
+    summarize_plan(WRAPPED_INDEX_OR["queryPlanner"]["winningPlan"], stages, indexes)
+    assert stages == ["FETCH", "OR", "IXSCAN", "IXSCAN"]
+    assert indexes == ["category_1", "price_1"]
+
+
+def test_summarize_plan_ignores_empty_plan():
+    stages, indexes = [], []
+    summarize_plan({}, stages, indexes)
+    assert stages == [] and indexes == []
+
+
+@pytest.mark.parametrize("result, collscan, in_memory_sort, indexes", [
+    (CLASSIC_COLLSCAN_SORT, True, True, []),
+    (WRAPPED_INDEX_OR, False, False, ["category_1", "price_1"]),
+])
+def test_explain_product_query_flags(monkeypatch, result, collscan, in_memory_sort, indexes):
+    fake_db = FakeDatabase(result)
+    monkeypatch.setattr(server, "db", fake_db)
+    query, sort_order = build_product_query(category="Tools", sort_by="price_asc")
+
+    report = asyncio.run(explain_product_query(query, sort_order))
+
+    assert report["collscan"] is collscan
+    assert report["in_memory_sort"] is in_memory_sort
+    assert report["indexes"] == indexes
+    assert report["docs_examined"] == result["executionStats"]["totalDocsExamined"]
+    assert report["returned"] == result["executionStats"]["nReturned"]
+    assert fake_db.commands[0]["verbosity"] == "executionStats"
+    assert fake_db.commands[0]["explain"]["sort"] == {"price": 1}
+
+
+def test_describe_query_shape_hides_values():
+    query, sort_order = build_product_query(search="drill bit", min_price=5, stock_status="low_stock")
+    assert describe_query_shape(query, sort_order) == (
+        "{'$or': [{'name': {'$regex': '?'}}, {'description': {'$regex': '?'}}, {'category': {'$regex': '?'}}], "
+        "'price': {'$gte': '?'}, 'stock': {'$gt': '?', '$lt': '?'}} sort=createdAt:-1"
+    )
+    other, _ = build_product_query(search="hammer", min_price=50, stock_status="low_stock")
+    assert describe_query_shape(other, sort_order) == describe_query_shape(query, sort_order)
+
+
+def test_slow_query_recorded_above_threshold(monkeypatch):
+    monkeypatch.setattr(server, "SLOW_QUERY_MS", 50.0)
+    server.slow_queries.clear()
+    query, sort_order = build_product_query(category="Tools")
+
+    record_slow_query("products", query, sort_order, 49.9, 3)
+    assert list(server.slow_queries) == []
+
+    record_slow_query("products", query, sort_order, 75.0, 3)
+    assert len(server.slow_queries) == 1
+    entry = server.slow_queries[0]
+    assert entry["shape"] == "{'category': '?'} sort=createdAt:-1"
+    assert entry["elapsed_ms"] == 75.0
+    assert entry["returned"] == 3
+
+
+def test_slow_query_log_off_without_threshold(monkeypatch):
+    monkeypatch.setattr(server, "SLOW_QUERY_MS", None)
+    server.slow_queries.clear()
+    record_slow_query("products", {}, [("createdAt", -1)], 10_000.0, 1)
+    assert list(server.slow_queries) == []
+
+
+def test_build_product_query_matches_baseline():
+    # Expected values are what get_products built inline before the refactor
+    pattern = re.compile("drill.*bit", re.IGNORECASE)
+    assert build_product_query(search="drill bit") == ({
+        "$or": [
+            {"name": {"$regex": pattern}},
+            {"description": {"$regex": pattern}},
+            {"category": {"$regex": pattern}}
+        ]
+    }, [("createdAt", -1)])
+    assert build_product_query(category="Tools", min_price=10, max_price=100, sort_by="price_asc") == (
+        {"category": "Tools", "price": {"$gte": 10, "$lte": 100}}, [("price", 1)]
+    )
+    assert build_product_query(max_price=0, sort_by="price_desc") == ({"price": {"$lte": 0}}, [("price", -1)])
+    assert build_product_query(stock_status="in_stock", sort_by="newest") == ({"stock": {"$gte": 10}}, [("createdAt", -1)])
+    assert build_product_query(stock_status="low_stock") == ({"stock": {"$gt": 0, "$lt": 10}}, [("createdAt", -1)])
+    assert build_product_query(stock_status="out_of_stock") == ({"stock": 0}, [("createdAt", -1)])
+    assert build_product_query(stock_status="bogus", sort_by="bogus") == ({}, [("createdAt", -1)])
+    assert build_product_query() == ({}, [("createdAt", -1)])
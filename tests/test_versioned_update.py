@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from pydantic import ValidationError
+from starlette.requests import Request
+
+from server import MAX_VERSION, CategoryUpdate, ProductUpdate, get_expected_versions, versioned_update
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = {doc["id"]: dict(doc) for doc in docs}
+
+    def _matches(self, doc, query):
+        if doc["id"] != query["id"]:
+            return False
+        return "version" not in query or doc["version"] in query["version"]["$in"]
+
+    async def find_one_and_update(self, query, update, projection=None, return_document=None):
+        doc = self.docs.get(query["id"])
+        if doc is None or not self._matches(doc, query):
+            return None
+        doc.update(update["$set"])
+        doc["version"] += update["$inc"]["version"]
+        return dict(doc)
+
+    async def count_documents(self, query, limit=0):
+        return int(query["id"] in self.docs)
+
+
+def make_request(if_match=None):
+    headers = [(b"if-match", if_match.encode("latin-1"))] if if_match is not None else []
+    return Request({"type": "http", "headers": headers})
+
+
+def update(collection, expected_versions, doc_id="p1"):
+    return asyncio.run(versioned_update(collection, doc_id, {"name": "New"}, expected_versions, "Product not found"))
+
+
+def test_if_match_matches_any_strong_tag():
+    assert get_expected_versions(make_request('"3", "5"'), None) == [3, 5]
+
+
+def test_if_match_weak_tags_never_match():
+    assert get_expected_versions(make_request('W/"3"'), None) == []
+    assert get_expected_versions(make_request('W/"3", "4"'), None) == [4]
+
+
+def test_if_match_non_ascii_digits_never_match():
+    assert get_expected_versions(make_request('"\u00b2"'), None) == []
+    assert get_expected_versions(make_request('"\u00b2", "2"'), None) == [2]
+
+
+def test_if_match_out_of_range_version_never_matches():
+    assert get_expected_versions(make_request(f'"{MAX_VERSION}"'), None) == [MAX_VERSION]
+    assert get_expected_versions(make_request(f'"{MAX_VERSION + 1}"'), None) == []
+
+
+def test_out_of_range_if_match_returns_412():
+    collection = FakeCollection([{"id": "p1", "name": "Old", "version": 1}])
+    with pytest.raises(HTTPException) as exc:
+        update(collection, get_expected_versions(make_request(f'"{2**64}"'), None))
+    assert exc.value.status_code == 412
+
+
+def test_body_expected_version_is_bounded():
+    for model in (ProductUpdate, CategoryUpdate):
+        assert model(expected_version=MAX_VERSION).expected_version == MAX_VERSION
+        for bad in (0, -1, MAX_VERSION + 1):
+            with pytest.raises(ValidationError):
+                model(expected_version=bad)
+
+
+def test_if_match_wildcard_and_body_version():
+    assert get_expected_versions(make_request("*"), 2) == [2]
+    assert get_expected_versions(make_request(), None) is None
+    assert get_expected_versions(make_request('"7"'), 2) == [7]
+
+
+def test_update_bumps_version():
+    collection = FakeCollection([{"id": "p1", "name": "Old", "version": 1}])
+    updated = update(collection, [1])
+    assert updated == {"id": "p1", "name": "New", "version": 2}
+
+
+def test_stale_version_returns_412():
+    collection = FakeCollection([{"id": "p1", "name": "Old", "version": 2}])
+    with pytest.raises(HTTPException) as exc:
+        update(collection, [1])
+    assert exc.value.status_code == 412
+    assert collection.docs["p1"]["name"] == "Old"
+
+
+def test_weak_only_if_match_returns_412():
+    collection = FakeCollection([{"id": "p1", "name": "Old", "version": 1}])
+    with pytest.raises(HTTPException) as exc:
+        update(collection, get_expected_versions(make_request('W/"1"'), None))
+    assert exc.value.status_code == 412
+
+
+def test_missing_document_returns_404():
+    collection = FakeCollection([])
+    for expected in (None, [1]):
+        with pytest.raises(HTTPException) as exc:
+            update(collection, expected)
+        assert exc.value.status_code == 404